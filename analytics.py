@@ -1,16 +1,35 @@
 from __future__ import annotations
 
-from typing import Dict, List
+import math
+import asyncio
+import re
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Dict, Optional, Tuple
 
-from fastapi import APIRouter, Query
+from cachetools import TTLCache
+from fastapi import APIRouter, HTTPException, Query
 from fastapi.responses import JSONResponse
+import numpy as np
+import orjson
 import pandas as pd
 import yfinance as yf
 
-from analytics import compute_metrics_from_close
+try:
+    from numba import njit
+except ImportError:  # numba is optional; compute_metrics_from_close falls back to pandas
+    njit = None
 
 router = APIRouter(prefix="/api", tags=["metrics"])
 
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse rendered by orjson; NumPy arrays (incl. datetime64) are serialised without a list detour."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC)
+
+
 # Keep these consistent with the UI controls
 RANGE_MAP = {
     "1M": "1mo",
@@ -22,62 +41,280 @@ RANGE_MAP = {
 }
 INTERVAL_MAP = {"d": "1d", "w": "1wk", "m": "1mo"}
 
+# Closed sets are checked by membership; only tickers need a (precompiled) pattern
+_INTERVALS = frozenset(INTERVAL_MAP)
+_RANGES = frozenset(RANGE_MAP)
+_TICKER_RE = re.compile(r"^[A-Za-z0-9.\-^=]{1,10}$")
+
+# Raw per-ticker yfinance frames keyed on (ticker, yf_period, yf_interval); repeat requests skip Yahoo
+_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=300)
+# Serialised /api/metrics blocks keyed on (ticker, yf_period, interval, last bar ns); new bars miss
+_METRICS_CACHE: TTLCache = TTLCache(maxsize=4096, ttl=60)
+_CACHE_LOCK = Lock()  # guards both caches
+
+_COLUMNS = {
+    "Open": "open",
+    "High": "high",
+    "Low": "low",
+    "Close": "close",
+    "Adj Close": "adj_close",
+    "Volume": "volume",
+}
+_RAW_COLUMNS = {v: k for k, v in _COLUMNS.items()}
+
+
+def _validate_params(interval: str, range_: str) -> None:
+    if interval not in _INTERVALS:
+        raise HTTPException(status_code=422, detail=f"interval must be one of {sorted(_INTERVALS)}")
+    if range_ not in _RANGES:
+        raise HTTPException(status_code=422, detail=f"range must be one of {sorted(_RANGES)}")
+
+
+def _parse_tickers(s: str) -> Tuple[str, ...]:
+    """Split the query string once into valid, upper-cased tickers, deduplicated in order."""
+    parts = (p.strip().upper() for p in s.split(","))
+    return tuple(dict.fromkeys(p for p in parts if _TICKER_RE.match(p)))
+
+
+def _slice_ticker(raw: pd.DataFrame, ticker: str) -> pd.DataFrame:
+    """Pull one ticker's columns out of a ``group_by="ticker"`` download."""
+    if raw is None or raw.index.size == 0:
+        return pd.DataFrame()
+    if isinstance(raw.columns, pd.MultiIndex):
+        if ticker not in raw.columns.get_level_values(0):
+            return pd.DataFrame()
+        raw = raw[ticker]
+    # The wide frame is aligned on the union of all tickers' dates
+    return raw.dropna(how="all")
 
-def _download_one(ticker: str, yf_period: str, yf_interval: str) -> pd.DataFrame:
-    """Download OHLC with yfinance and return a tidy DataFrame (date index).
-    Columns: open, high, low, close, adj_close, volume
+
+def _download_many(
+    tickers: Tuple[str, ...],
+    yf_period: str,
+    yf_interval: str,
+    columns: Tuple[str, ...] = tuple(_COLUMNS.values()),
+) -> Dict[str, pd.DataFrame]:
+    """Download OHLC for several tickers (as returned by _parse_tickers) and return tidy DataFrames (date index).
+    Columns: the requested subset of open, high, low, close, adj_close, volume
+    Cached tickers are served locally; the rest share a single yf.download call.
     """
-    df = yf.download(
-        ticker,
-        period=yf_period,
-        interval=yf_interval,
-        progress=False,
-        auto_adjust=False,
-    )
-    if df is None or df.empty:
-        return pd.DataFrame(columns=["open", "high", "low", "close", "adj_close", "volume"]).set_index(
-            pd.DatetimeIndex([], name="Date")
+    raw_frames: Dict[str, pd.DataFrame] = {}
+    with _CACHE_LOCK:
+        for t in tickers:
+            df = _CACHE.get((t, yf_period, yf_interval))
+            if df is not None:
+                raw_frames[t] = df
+    missing = [t for t in tickers if t not in raw_frames]
+    if missing:
+        # A lone ticker (the usual dashboard case) gains nothing from yfinance's thread pool
+        raw = yf.download(
+            " ".join(missing),
+            period=yf_period,
+            interval=yf_interval,
+            group_by="ticker",
+            threads=len(missing) > 1,
+            progress=False,
+            auto_adjust=False,
         )
-    df = df.rename(
-        columns={
-            "Open": "open",
-            "High": "high",
-            "Low": "low",
-            "Close": "close",
-            "Adj Close": "adj_close",
-            "Volume": "volume",
-        }
+        for t in missing:
+            df = _slice_ticker(raw, t)
+            raw_frames[t] = df
+            if df.index.size:
+                with _CACHE_LOCK:
+                    _CACHE[(t, yf_period, yf_interval)] = df
+
+    out: Dict[str, pd.DataFrame] = {}
+    for t, df in raw_frames.items():
+        if df.index.size == 0:
+            out[t] = pd.DataFrame(columns=list(columns)).set_index(
+                pd.DatetimeIndex([], name="Date")
+            )
+            continue
+        # Project before anything else; the selection is a new frame, so the cached one is never mutated
+        df = df[[_RAW_COLUMNS[c] for c in columns if _RAW_COLUMNS[c] in df.columns]]
+        df = df.rename(columns=_COLUMNS)
+        # yfinance already hands back a sorted DatetimeIndex; only fix it up if not
+        if not isinstance(df.index, pd.DatetimeIndex):
+            df.index = pd.to_datetime(df.index)
+        if not df.index.is_monotonic_increasing:
+            df = df.sort_index()
+        out[t] = df
+    return out
+
+
+# Periods per year for each UI interval
+ANN_FACTOR = {"d": 252.0, "w": 52.0, "m": 12.0}
+ROLLING_WINDOW = 30
+
+
+@dataclass
+class MetricsSeries:
+    dates: np.ndarray  # datetime64; orjson renders ISO strings
+    returns: np.ndarray
+    rolling_vol_30: np.ndarray
+
+
+@dataclass
+class MetricsSummary:
+    annualised_return: Optional[float]
+    annualised_volatility: Optional[float]
+    var_95_1d: Optional[float]
+    var_99_1d: Optional[float]
+
+
+@dataclass
+class MetricsResult:
+    series: MetricsSeries
+    summary: MetricsSummary
+
+
+def _quantile_sorted(xs: np.ndarray, q: float) -> float:
+    """Linear-interpolated quantile of an already sorted array (matches np.quantile)."""
+    pos = q * (xs.shape[0] - 1)
+    lo = int(math.floor(pos))
+    hi = min(lo + 1, xs.shape[0] - 1)
+    return xs[lo] + (xs[hi] - xs[lo]) * (pos - lo)
+
+
+def _metrics_kernel(
+    close: np.ndarray, ann_factor: float, window: int
+) -> Tuple[np.ndarray, np.ndarray, float, float, float, float]:
+    """Log returns, rolling annualised vol and summary stats in a single pass.
+    The rolling variance is updated in O(1) per step (Welford add/remove).
+    """
+    n = close.shape[0] - 1
+    r = np.empty(n)
+    vol = np.full(n, np.nan)
+    mean = 0.0
+    m2 = 0.0
+    w_mean = 0.0
+    w_m2 = 0.0
+    for i in range(n):
+        x = math.log(close[i + 1] / close[i])
+        r[i] = x
+        # Whole-sample accumulators
+        d = x - mean
+        mean += d / (i + 1)
+        m2 += d * (x - mean)
+        # Rolling-window accumulators
+        if i < window:
+            d = x - w_mean
+            w_mean += d / (i + 1)
+            w_m2 += d * (x - w_mean)
+        else:
+            old = r[i - window]
+            new_mean = w_mean + (x - old) / window
+            w_m2 += (x - old) * (x - new_mean + old - w_mean)
+            w_mean = new_mean
+        if i >= window - 1:
+            vol[i] = math.sqrt(max(w_m2, 0.0) / (window - 1) * ann_factor)
+
+    ann_ret = mean * ann_factor
+    ann_vol = math.sqrt(m2 / (n - 1) * ann_factor) if n > 1 else np.nan
+    srt = np.sort(r)
+    var95 = -_quantile_sorted(srt, 0.05)
+    var99 = -_quantile_sorted(srt, 0.01)
+    return r, vol, ann_ret, ann_vol, var95, var99
+
+
+def _metrics_pandas(
+    close: np.ndarray, ann_factor: float, window: int
+) -> Tuple[np.ndarray, np.ndarray, float, float, float, float]:
+    """Reference implementation used when numba is not installed."""
+    r = np.diff(np.log(close))
+    vol = (pd.Series(r).rolling(window).std() * math.sqrt(ann_factor)).to_numpy()
+    ann_vol = float(r.std(ddof=1) * math.sqrt(ann_factor)) if r.shape[0] > 1 else np.nan
+    var95, var99 = -np.quantile(r, [0.05, 0.01])
+    return r, vol, float(r.mean() * ann_factor), ann_vol, float(var95), float(var99)
+
+
+if njit is not None:
+    _quantile_sorted = njit(cache=True)(_quantile_sorted)
+    _compute_metrics = njit(cache=True, fastmath=True)(_metrics_kernel)
+else:
+    _compute_metrics = _metrics_pandas
+
+
+def _opt(x: float) -> Optional[float]:
+    return None if math.isnan(x) else float(x)
+
+
+def compute_metrics_from_close(close: Optional[pd.Series], interval: str) -> MetricsResult:
+    """Return/volatility/VaR analytics for a close-price series with a date index.
+    Returns are log returns; VaR is historical and reported as a positive loss.
+    """
+    if close is not None:
+        close = close.dropna()
+    if close is None or len(close) < 2:
+        return MetricsResult(
+            series=MetricsSeries(
+                dates=np.empty(0, dtype="datetime64[ns]"), returns=np.empty(0), rolling_vol_30=np.empty(0)
+            ),
+            summary=MetricsSummary(None, None, None, None),
+        )
+
+    r, vol, ann_ret, ann_vol, var95, var99 = _compute_metrics(
+        close.to_numpy(dtype=np.float64), ANN_FACTOR.get(interval, 252.0), ROLLING_WINDOW
+    )
+    return MetricsResult(
+        series=MetricsSeries(
+            dates=close.index[1:].values,
+            returns=r,
+            rolling_vol_30=vol,
+        ),
+        summary=MetricsSummary(
+            annualised_return=_opt(ann_ret),
+            annualised_volatility=_opt(ann_vol),
+            var_95_1d=_opt(var95),
+            var_99_1d=_opt(var99),
+        ),
     )
-    df.index = pd.to_datetime(df.index)
-    df = df.sort_index()
-    return df
+
+
+def _metric_payload(ticker: str, df: pd.DataFrame, yf_period: str, interval: str) -> Dict[str, dict]:
+    """Metrics block for one ticker as served by /api/metrics.
+    Memoised until the TTL expires or a newer bar arrives.
+    """
+    key = (ticker, yf_period, interval, int(df.index[-1].value)) if df.index.size else None
+    if key is not None:
+        with _CACHE_LOCK:
+            payload = _METRICS_CACHE.get(key)
+        if payload is not None:
+            return payload
+
+    m = compute_metrics_from_close(df.get("close"), interval)
+    payload = {
+        "series": {
+            "dates": m.series.dates,
+            "returns": m.series.returns,
+            "rolling_vol_30": m.series.rolling_vol_30,
+        },
+        "summary": {
+            "annualised_return": m.summary.annualised_return,
+            "annualised_volatility": m.summary.annualised_volatility,
+            "var_95_1d": m.summary.var_95_1d,
+            "var_99_1d": m.summary.var_99_1d,
+        },
+    }
+    if key is not None:
+        with _CACHE_LOCK:
+            _METRICS_CACHE[key] = payload
+    return payload
 
 
 @router.get("/metrics")
 async def metrics(
     tickers: str = Query(..., description="Comma-separated Yahoo tickers, e.g., AAPL,MSFT,VOD.L"),
-    interval: str = Query("d", regex="^(d|w|m)$", description="d=1d, w=1wk, m=1mo"),
-    range_: str = Query("1Y", alias="range", regex="^(1M|3M|6M|1Y|5Y|MAX)$"),
+    interval: str = Query("d", description="d=1d, w=1wk, m=1mo"),
+    range_: str = Query("1Y", alias="range", description="1M, 3M, 6M, 1Y, 5Y or MAX"),
 ):
-    yf_period = RANGE_MAP.get(range_, "1y")
-    yf_interval = INTERVAL_MAP.get(interval, "1d")
-
-    out: Dict[str, dict] = {}
-    for t in [x.strip() for x in tickers.split(",") if x.strip()]:
-        df = _download_one(t, yf_period, yf_interval)
-        m = compute_metrics_from_close(df.get("close"), interval)
-        out[t.upper()] = {
-            "series": {
-                "dates": m.series.dates,
-                "returns": m.series.returns,
-                "rolling_vol_30": m.series.rolling_vol_30,
-            },
-            "summary": {
-                "annualised_return": m.summary.annualised_return,
-                "annualised_volatility": m.summary.annualised_volatility,
-                "var_95_1d": m.summary.var_95_1d,
-                "var_99_1d": m.summary.var_99_1d,
-            },
-        }
-
-    return JSONResponse({"tickers": list(out.keys()), "interval": interval, "range": range_, "metrics": out})
+    _validate_params(interval, range_)
+    yf_period = RANGE_MAP[range_]
+    yf_interval = INTERVAL_MAP[interval]
+
+    ticker_list = _parse_tickers(tickers)
+    frames = await asyncio.to_thread(_download_many, ticker_list, yf_period, yf_interval, ("close",))
+
+    out = {t: _metric_payload(t, frames[t], yf_period, interval) for t in ticker_list}
+
+    return ORJSONResponse({"tickers": list(ticker_list), "interval": interval, "range": range_, "metrics": out})
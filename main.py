@@ -1,13 +1,28 @@
-from fastapi import FastAPI, Query
+import asyncio
+import re
+from threading import Lock
+
+from cachetools import TTLCache
+
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 import yfinance as yf
 import pandas as pd
-from typing import List, Dict
+from typing import Any, Dict, Optional, Tuple
+
+import orjson
 
 from analytics import compute_metrics_from_close  # uses your analytics.py
 
+class ORJSONResponse(JSONResponse):
+    """JSONResponse rendered by orjson; NumPy arrays (incl. datetime64) are serialised without a list detour."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC)
+
 app = FastAPI(title="Smart Stock Viewer API")
 
 # CORS for dev
@@ -18,51 +33,159 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# OHLC/metrics payloads are long numeric arrays that compress well
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 # Map UI params → yfinance params
 RANGE_MAP = {"1M": "1mo", "3M": "3mo", "6M": "6mo", "1Y": "1y", "5Y": "5y", "MAX": "max"}
 INTERVAL_MAP = {"d": "1d", "w": "1wk", "m": "1mo"}
 
-def _download_one(ticker: str, yf_period: str, yf_interval: str) -> List[Dict]:
-    df = yf.download(ticker, period=yf_period, interval=yf_interval,
-                     progress=False, auto_adjust=False)
-    if df is None or df.empty:
-        return []
-    df = df.rename(columns={
-        "Open": "open", "High": "high", "Low": "low", "Close": "close",
-        "Adj Close": "adj_close", "Volume": "volume",
-    })
-    df.index = pd.to_datetime(df.index)
-    out = []
-    for idx, row in df.iterrows():
-        out.append({
-            "date": idx.strftime("%Y-%m-%d"),
-            "open": float(row.get("open", float("nan"))),
-            "high": float(row.get("high", float("nan"))),
-            "low": float(row.get("low", float("nan"))),
-            "close": float(row.get("close", float("nan"))),
-            "volume": float(row.get("volume", 0.0)),
-        })
+# Closed sets are checked by membership; only tickers need a (precompiled) pattern
+_INTERVALS = frozenset(INTERVAL_MAP)
+_RANGES = frozenset(RANGE_MAP)
+_TICKER_RE = re.compile(r"^[A-Za-z0-9.\-^=]{1,10}$")
+
+# Raw per-ticker yfinance frames keyed on (ticker, yf_period, yf_interval); repeat requests skip Yahoo
+_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=300)
+# Serialised /api/metrics blocks keyed on (ticker, yf_period, interval, last bar ns); new bars miss
+_METRICS_CACHE: TTLCache = TTLCache(maxsize=4096, ttl=60)
+_CACHE_LOCK = Lock()  # guards both caches
+
+_COLUMNS = {
+    "Open": "open", "High": "high", "Low": "low", "Close": "close",
+    "Adj Close": "adj_close", "Volume": "volume",
+}
+_RAW_COLUMNS = {v: k for k, v in _COLUMNS.items()}
+_OHLC_COLUMNS = ("open", "high", "low", "close", "volume")
+
+def _validate_params(interval: str, range_: str) -> None:
+    if interval not in _INTERVALS:
+        raise HTTPException(status_code=422, detail=f"interval must be one of {sorted(_INTERVALS)}")
+    if range_ not in _RANGES:
+        raise HTTPException(status_code=422, detail=f"range must be one of {sorted(_RANGES)}")
+
+def _parse_tickers(s: str) -> Tuple[str, ...]:
+    """Split the query string once into valid, upper-cased tickers, deduplicated in order."""
+    parts = (p.strip().upper() for p in s.split(","))
+    return tuple(dict.fromkeys(p for p in parts if _TICKER_RE.match(p)))
+
+def _empty_ohlc() -> Dict[str, Any]:
+    return {"date": [], "open": [], "high": [], "low": [], "close": [], "volume": []}
+
+def _slice_ticker(raw: pd.DataFrame, ticker: str) -> pd.DataFrame:
+    """Pull one ticker's columns out of a group_by='ticker' download."""
+    if raw is None or raw.index.size == 0:
+        return pd.DataFrame()
+    if isinstance(raw.columns, pd.MultiIndex):
+        if ticker not in raw.columns.get_level_values(0):
+            return pd.DataFrame()
+        raw = raw[ticker]
+    # The wide frame is aligned on the union of all tickers' dates
+    return raw.dropna(how="all")
+
+def _download_many(tickers: Tuple[str, ...], yf_period: str, yf_interval: str,
+                   columns: Tuple[str, ...] = tuple(_COLUMNS.values())) -> Dict[str, pd.DataFrame]:
+    """Fetch every uncached ticker in a single yf.download call; `tickers` come from _parse_tickers.
+    Only `columns` are carried into the returned frames (the cache keeps the full download).
+    """
+    raw_frames: Dict[str, pd.DataFrame] = {}
+    with _CACHE_LOCK:
+        for t in tickers:
+            df = _CACHE.get((t, yf_period, yf_interval))
+            if df is not None:
+                raw_frames[t] = df
+    missing = [t for t in tickers if t not in raw_frames]
+    if missing:
+        # A lone ticker (the usual dashboard case) gains nothing from yfinance's thread pool
+        raw = yf.download(" ".join(missing), period=yf_period, interval=yf_interval,
+                          group_by="ticker", threads=len(missing) > 1, progress=False, auto_adjust=False)
+        for t in missing:
+            df = _slice_ticker(raw, t)
+            raw_frames[t] = df
+            if df.index.size:
+                with _CACHE_LOCK:
+                    _CACHE[(t, yf_period, yf_interval)] = df
+
+    out: Dict[str, pd.DataFrame] = {}
+    for t, df in raw_frames.items():
+        if df.index.size == 0:
+            out[t] = pd.DataFrame(columns=list(columns)).set_index(
+                pd.DatetimeIndex([], name="Date"))
+            continue
+        # Project before anything else; the selection is a new frame, so the cached one is never mutated
+        df = df[[_RAW_COLUMNS[c] for c in columns if _RAW_COLUMNS[c] in df.columns]]
+        df = df.rename(columns=_COLUMNS)
+        # yfinance already hands back a sorted DatetimeIndex; only fix it up if not
+        if not isinstance(df.index, pd.DatetimeIndex):
+            df.index = pd.to_datetime(df.index)
+        if not df.index.is_monotonic_increasing:
+            df = df.sort_index()
+        out[t] = df
     return out
 
+def _to_columns(df: pd.DataFrame) -> Dict[str, Any]:
+    # Columnar payload: one flat array per field instead of a dict per row
+    return {
+        # Epoch milliseconds, which JS Date accepts directly
+        "date": df.index.as_unit("ms").asi8,
+        "open": df["open"].to_numpy(dtype=float),
+        "high": df["high"].to_numpy(dtype=float),
+        "low": df["low"].to_numpy(dtype=float),
+        "close": df["close"].to_numpy(dtype=float),
+        "volume": df["volume"].fillna(0.0).to_numpy(dtype=float),
+    }
+
+def _metric_payload(ticker: str, df: Optional[pd.DataFrame], yf_period: str, interval: str) -> Dict[str, dict]:
+    if df is None or df.index.size == 0:
+        return {
+            "series": {"dates": [], "returns": [], "rolling_vol_30": []},
+            "summary": {"annualised_return": None, "annualised_volatility": None,
+                        "var_95_1d": None, "var_99_1d": None}
+        }
+    key = (ticker, yf_period, interval, int(df.index[-1].value))
+    with _CACHE_LOCK:
+        payload = _METRICS_CACHE.get(key)
+    if payload is not None:
+        return payload
+
+    m = compute_metrics_from_close(df["close"], interval)
+    payload = {
+        "series": {
+            "dates": m.series.dates,
+            "returns": m.series.returns,
+            "rolling_vol_30": m.series.rolling_vol_30,
+        },
+        "summary": {
+            "annualised_return": m.summary.annualised_return,
+            "annualised_volatility": m.summary.annualised_volatility,
+            "var_95_1d": m.summary.var_95_1d,
+            "var_99_1d": m.summary.var_99_1d,
+        },
+    }
+    with _CACHE_LOCK:
+        _METRICS_CACHE[key] = payload
+    return payload
+
 @app.get("/api/ohlc")
 async def ohlc(
     tickers: str = Query(..., description="Comma-separated Yahoo tickers, e.g., AAPL,MSFT,VOD.L"),
-    interval: str = Query("d", regex="^(d|w|m)$", description="d=1d, w=1wk, m=1mo"),
-    range_: str = Query("1Y", alias="range", regex="^(1M|3M|6M|1Y|5Y|MAX)$"),
+    interval: str = Query("d", description="d=1d, w=1wk, m=1mo"),
+    range_: str = Query("1Y", alias="range", description="1M, 3M, 6M, 1Y, 5Y or MAX"),
 ):
-    yf_period = RANGE_MAP.get(range_, "1y")
-    yf_interval = INTERVAL_MAP.get(interval, "1d")
-
-    results: Dict[str, List[Dict]] = {}
-    for t in [x.strip() for x in tickers.split(",") if x.strip()]:
-        try:
-            results[t.upper()] = _download_one(t, yf_period, yf_interval)
-        except Exception:
-            results[t.upper()] = []
-
-    return JSONResponse({
-        "tickers": list(results.keys()),
+    _validate_params(interval, range_)
+    yf_period = RANGE_MAP[range_]
+    yf_interval = INTERVAL_MAP[interval]
+
+    ticker_list = _parse_tickers(tickers)
+    try:
+        frames = await asyncio.to_thread(_download_many, ticker_list, yf_period, yf_interval, _OHLC_COLUMNS)
+    except Exception:
+        frames = {}
+
+    results = {t: _to_columns(frames[t]) if t in frames else _empty_ohlc() for t in ticker_list}
+
+    return ORJSONResponse({
+        "tickers": list(ticker_list),
         "interval": interval,
         "range": range_,
         "data": results,
@@ -71,42 +194,33 @@ async def ohlc(
 @app.get("/api/metrics")
 async def metrics(
     tickers: str = Query(..., description="Comma-separated Yahoo tickers, e.g., AAPL,MSFT,VOD.L"),
-    interval: str = Query("d", regex="^(d|w|m)$", description="d=1d, w=1wk, m=1mo"),
-    range_: str = Query("1Y", alias="range", regex="^(1M|3M|6M|1Y|5Y|MAX)$"),
+    interval: str = Query("d", description="d=1d, w=1wk, m=1mo"),
+    range_: str = Query("1Y", alias="range", description="1M, 3M, 6M, 1Y, 5Y or MAX"),
 ):
-    yf_period = RANGE_MAP.get(range_, "1y")
-    yf_interval = INTERVAL_MAP.get(interval, "1d")
-
-    out: Dict[str, dict] = {}
-    for t in [x.strip() for x in tickers.split(",") if x.strip()]:
-        rows = _download_one(t, yf_period, yf_interval)
-        if not rows:
-            out[t.upper()] = {
-                "series": {"dates": [], "returns": [], "rolling_vol_30": []},
-                "summary": {"annualised_return": None, "annualised_volatility": None,
-                            "var_95_1d": None, "var_99_1d": None}
-            }
-            continue
-        df = pd.DataFrame(rows)
-        df["date"] = pd.to_datetime(df["date"])
-        df = df.sort_values("date").set_index("date")
-
-        m = compute_metrics_from_close(df["close"], interval)
-        out[t.upper()] = {
-            "series": {
-                "dates": m.series.dates,
-                "returns": m.series.returns,
-                "rolling_vol_30": m.series.rolling_vol_30,
-            },
-            "summary": {
-                "annualised_return": m.summary.annualised_return,
-                "annualised_volatility": m.summary.annualised_volatility,
-                "var_95_1d": m.summary.var_95_1d,
-                "var_99_1d": m.summary.var_99_1d,
-            },
-        }
+    _validate_params(interval, range_)
+    yf_period = RANGE_MAP[range_]
+    yf_interval = INTERVAL_MAP[interval]
+
+    ticker_list = _parse_tickers(tickers)
+    try:
+        frames = await asyncio.to_thread(_download_many, ticker_list, yf_period, yf_interval, ("close",))
+    except Exception:
+        frames = {}
+
+    out = {t: _metric_payload(t, frames.get(t), yf_period, interval) for t in ticker_list}
+
+    return ORJSONResponse({"tickers": list(ticker_list), "interval": interval, "range": range_, "metrics": out})
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles that lets browsers keep assets for an hour but always revalidate HTML."""
 
-    return JSONResponse({"tickers": list(out.keys()), "interval": interval, "range": range_, "metrics": out})
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if str(full_path).endswith((".html", ".htm")):
+            response.headers["Cache-Control"] = "no-cache"
+        else:
+            response.headers["Cache-Control"] = "public, max-age=3600"
+        return response
 
 # Keep this LAST so it doesn't swallow /api routes
-app.mount("/", StaticFiles(directory=".", html=True), name="static")
+app.mount("/", CachedStaticFiles(directory=".", html=True), name="static")